@@ -1,7 +1,11 @@
 from flask import Flask
 from flask_restful import Api
 from mongoengine import connect
-from utils.json_encoder import MongodbJSONProvider
+from mongoengine.errors import ValidationError
+from bson.errors import InvalidId
+from werkzeug.exceptions import HTTPException
+from utils.json_encoder import MongodbJSONProvider, output_json
+from utils.listing_feed import listing_feed
 
 # Import resources
 from resources.listing_resource import (
@@ -29,6 +33,10 @@ from resources.user_resource import UserListResource, UserResource
 
 app = Flask(__name__)
 
+# Flask-RESTful only defers to the app's error handlers when exceptions
+# propagate; without this it turns every unhandled error into a bare 500
+app.config['PROPAGATE_EXCEPTIONS'] = True
+
 # Use custom JSON provider
 app.json = MongodbJSONProvider(app)
 
@@ -39,8 +47,32 @@ connect(
     port=27017
 )
 
-# Initialize Flask-RESTful
+# Serve the listings page from memory once the change stream is running
+listing_feed.start()
+
+# Initialize Flask-RESTful and encode its responses with orjson
 api = Api(app)
+api.representations['application/json'] = output_json
+
+# ============================================================================
+# Error Handlers
+# ============================================================================
+
+@app.errorhandler(ValidationError)
+@app.errorhandler(InvalidId)
+@app.errorhandler(ValueError)
+def handle_bad_request(e):
+    """Invalid input rejected by the models or by type conversion"""
+    return {'error': str(e)}, 400
+
+
+@app.errorhandler(Exception)
+def handle_unexpected_error(e):
+    """Report anything else as a server error without leaking internals"""
+    if isinstance(e, HTTPException):
+        return e
+    app.logger.error('Unhandled exception', exc_info=e)
+    return {'error': 'Internal server error'}, 500
 
 # ============================================================================
 # API Routes
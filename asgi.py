@@ -0,0 +1,7 @@
+from asgiref.wsgi import WsgiToAsgi
+from app import app
+
+# ASGI entry point for production servers, e.g.:
+#   granian --interface asgi asgi:asgi_app
+#   uvicorn asgi:asgi_app --workers 4
+asgi_app = WsgiToAsgi(app)
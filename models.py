@@ -1,8 +1,39 @@
-from mongoengine import Document, StringField, FloatField, DateTimeField, ReferenceField, IntField, BooleanField
+from mongoengine import Document, StringField, FloatField, DateTimeField, ObjectIdField, IntField, BooleanField
+from bson import ObjectId
 from datetime import datetime
 
 
-class User(Document):
+def raw_to_dict(document_cls, doc, exclude=()):
+    """Shape a raw PyMongo document like document_cls.to_dict without building a Document"""
+    # ObjectId values are left as-is; the JSON encoder writes them as strings
+    data = {'id': str(doc['_id'])}
+    for field in document_cls.api_fields:
+        if field in exclude:
+            continue
+        if field in doc:
+            data[field] = doc[field]
+        else:
+            # Missing keys get the field default, as a loaded Document would
+            default = document_cls._fields[field].default
+            data[field] = default() if callable(default) else default
+    return data
+
+
+class ApiDocument(Document):
+    """Base for models whose API representation is their id followed by api_fields"""
+    meta = {'abstract': True}
+
+    api_fields = ()
+
+    def to_dict(self):
+        data = {'id': str(self.id)}
+        for field in self.api_fields:
+            value = getattr(self, field)
+            data[field] = str(value) if isinstance(value, ObjectId) else value
+        return data
+
+
+class User(ApiDocument):
     """User model representing both buyers and sellers"""
     meta = {'collection': 'users'}
 
@@ -12,23 +43,30 @@ class User(Document):
     role = StringField(required=True, choices=['Buyer', 'Seller', 'Both'])
     verified = BooleanField(default=False)
     created_at = DateTimeField(default=datetime.utcnow)
+    # Running totals over the user's approved reviews
+    rating_sum = IntField(default=0)
+    rating_count = IntField(default=0)
+    # Moderations in flight and finished while legacy totals are unseeded
+    rating_pending = IntField()
+    rating_changes = IntField()
 
-    def to_dict(self):
-        return {
-            'id': str(self.id),
-            'name': self.name,
-            'email': self.email,
-            'role': self.role,
-            'verified': self.verified,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    api_fields = ('name', 'email', 'role', 'verified', 'created_at')
 
 
-class Listing(Document):
+class Listing(ApiDocument):
     """Listing model for items being sold"""
-    meta = {'collection': 'listings'}
-
-    seller_id = ReferenceField(User, required=True)
+    meta = {
+        'collection': 'listings',
+        'indexes': [
+            'seller_id',
+            ('status', '-created_at'),
+            ('status', 'price'),
+            ('status', 'category', '-created_at'),
+            ('status', 'category', 'price')
+        ]
+    }
+
+    seller_id = ObjectIdField(required=True)
     title = StringField(required=True, max_length=200)
     description = StringField(max_length=1000)
     price = FloatField(required=True, min_value=0)
@@ -47,69 +85,63 @@ class Listing(Document):
     )
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
+    photo_count = IntField(default=0)
 
-    def to_dict(self):
-        return {
-            'id': str(self.id),
-            'seller_id': str(self.seller_id.id),
-            'title': self.title,
-            'description': self.description,
-            'price': self.price,
-            'category': self.category,
-            'condition': self.condition,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
-
-
-class ListingPhoto(Document):
+    api_fields = (
+        'seller_id', 'title', 'description', 'price', 'category',
+        'condition', 'status', 'created_at', 'updated_at'
+    )
+
+
+class ListingPhoto(ApiDocument):
     """Photo model for listing images"""
-    meta = {'collection': 'listing_photos'}
+    meta = {
+        'collection': 'listing_photos',
+        'indexes': [('listing_id', 'display_order')]
+    }
 
-    listing_id = ReferenceField(Listing, required=True)
+    listing_id = ObjectIdField(required=True)
     photo_url = StringField(required=True, max_length=500)
     uploaded_at = DateTimeField(default=datetime.utcnow)
     display_order = IntField(required=True, default=0)
 
-    def to_dict(self):
-        return {
-            'id': str(self.id),
-            'listing_id': str(self.listing_id.id),
-            'photo_url': self.photo_url,
-            'uploaded_at': self.uploaded_at.isoformat() if self.uploaded_at else None,
-            'display_order': self.display_order
-        }
+    api_fields = ('listing_id', 'photo_url', 'uploaded_at', 'display_order')
 
 
-class ChatThread(Document):
+class ChatThread(ApiDocument):
     """Chat thread model for buyer-seller communication"""
-    meta = {'collection': 'chat_threads'}
-
-    listing_id = ReferenceField(Listing, required=True)
-    buyer_id = ReferenceField(User, required=True)
-    seller_id = ReferenceField(User, required=True)
+    meta = {
+        'collection': 'chat_threads',
+        'indexes': [
+            ('listing_id', '-last_activity_time'),
+            ('buyer_id', '-last_activity_time', '-id'),
+            ('seller_id', '-last_activity_time', '-id')
+        ]
+    }
+
+    listing_id = ObjectIdField(required=True)
+    buyer_id = ObjectIdField(required=True)
+    seller_id = ObjectIdField(required=True)
     created_at = DateTimeField(default=datetime.utcnow)
     last_activity_time = DateTimeField(default=datetime.utcnow)
 
-    def to_dict(self):
-        return {
-            'id': str(self.id),
-            'listing_id': str(self.listing_id.id),
-            'buyer_id': str(self.buyer_id.id),
-            'seller_id': str(self.seller_id.id),
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'last_activity_time': self.last_activity_time.isoformat() if self.last_activity_time else None
-        }
+    api_fields = ('listing_id', 'buyer_id', 'seller_id', 'created_at', 'last_activity_time')
 
 
-class Review(Document):
+class Review(ApiDocument):
     """Review model for transaction feedback"""
-    meta = {'collection': 'reviews'}
-
-    listing_id = ReferenceField(Listing, required=True)
-    reviewer_id = ReferenceField(User, required=True)
-    reviewee_id = ReferenceField(User, required=True)
+    meta = {
+        'collection': 'reviews',
+        'indexes': [
+            ('listing_id', 'moderation_status', '-created_at'),
+            ('reviewee_id', 'moderation_status', '-created_at'),
+            {'fields': ('listing_id', 'reviewer_id'), 'unique': True}
+        ]
+    }
+
+    listing_id = ObjectIdField(required=True)
+    reviewer_id = ObjectIdField(required=True)
+    reviewee_id = ObjectIdField(required=True)
     rating = IntField(required=True, min_value=1, max_value=5)
     comment = StringField(max_length=1000)
     helpful_count = IntField(default=0)
@@ -122,18 +154,7 @@ class Review(Document):
         choices=['Pending', 'Approved', 'Rejected']
     )
 
-    def to_dict(self):
-        return {
-            'id': str(self.id),
-            'listing_id': str(self.listing_id.id),
-            'reviewer_id': str(self.reviewer_id.id),
-            'reviewee_id': str(self.reviewee_id.id),
-            'rating': self.rating,
-            'comment': self.comment,
-            'helpful_count': self.helpful_count,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'is_flagged': self.is_flagged,
-            'moderation_status': self.moderation_status
-        }
-
+    api_fields = (
+        'listing_id', 'reviewer_id', 'reviewee_id', 'rating', 'comment',
+        'helpful_count', 'created_at', 'updated_at', 'is_flagged', 'moderation_status'
+    )
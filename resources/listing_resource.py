@@ -1,9 +1,25 @@
-from flask import request
+from flask import request, Response, stream_with_context
 from flask_restful import Resource
-from models import Listing, User
-from bson import ObjectId
+from models import Listing, User, raw_to_dict
 from datetime import datetime
 from utils.auth_utils import require_auth, require_role, is_owner
+from utils.validation import parse_oid, parse_pagination, get_json_body, parse_number
+from utils.cache import not_modified, document_response, store_document_etag, expire_etags
+from utils.json_encoder import iter_json_list
+from utils.listing_feed import listing_feed
+
+# Fields returned for each listing in the paginated listing view. The
+# description is left out unless requested with ?fields=description.
+LISTING_FIELDS = {
+    'seller_id': 1,
+    'title': 1,
+    'price': 1,
+    'category': 1,
+    'condition': 1,
+    'status': 1,
+    'created_at': 1,
+    'updated_at': 1
+}
 
 
 class ListingListResource(Resource):
@@ -11,73 +27,99 @@ class ListingListResource(Resource):
 
     def get(self):
         """Get all published listings with pagination and filters"""
-        try:
-            # Get query parameters
-            page = int(request.args.get('page', 1))
-            per_page = int(request.args.get('per_page', 10))
-            category = request.args.get('category')
-            sort_by = request.args.get('sort_by', 'created_at')
-
-            # Build query
-            query = {'status': 'Published'}
-            if category:
-                query['category'] = category
-
-            # Pagination
-            skip = (page - 1) * per_page
-
-            # Sort order
-            sort_field = 'price' if sort_by == 'price' else '-created_at'
-
-            listings = Listing.objects(**query).order_by(sort_field).skip(skip).limit(per_page)
-            total = Listing.objects(**query).count()
-
-            return {
-                'listings': [listing.to_dict() for listing in listings],
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'total_pages': (total + per_page - 1) // per_page
-            }, 200
-
-        except Exception as e:
-            return {'error': str(e)}, 400
+        # Get query parameters
+        page, per_page = parse_pagination()
+        category = request.args.get('category') or None
+        sort_by = request.args.get('sort_by', 'created_at')
+        include_description = 'description' in request.args.get('fields', '').split(',')
+
+        # Pagination
+        skip = (page - 1) * per_page
+
+        # Sort order
+        sort_field = 'price' if sort_by == 'price' else 'created_at'
+
+        # Serve the page from the in-memory feed, falling back to MongoDB
+        # while the change stream is unavailable
+        cached = listing_feed.page(category, sort_field, skip, per_page)
+        if cached:
+            docs, total = cached
+        else:
+            docs, total = self._query(category, sort_field, skip, per_page, include_description)
+        exclude = () if include_description else ('description',)
+
+        # Serialize and encode each listing as the response body is written
+        listings = (raw_to_dict(Listing, doc, exclude) for doc in docs)
+        body = iter_json_list(
+            'listings', listings,
+            page=page,
+            per_page=per_page,
+            total=total,
+            total_pages=(total + per_page - 1) // per_page
+        )
+        return Response(stream_with_context(body), status=200, mimetype='application/json')
+
+    @staticmethod
+    def _query(category, sort_field, skip, limit, include_description):
+        """Fetch one page of published listings and their total from MongoDB"""
+        # Build query
+        query = {'status': 'Published'}
+        if category:
+            query['category'] = category
+
+        # Projection
+        projection = LISTING_FIELDS
+        if include_description:
+            projection = dict(LISTING_FIELDS, description=1)
+
+        # Fetch the page and the total count in one round-trip. $match and
+        # $sort stay ahead of $facet so both can be served by an index.
+        result = next(Listing._get_collection().aggregate([
+            {'$match': query},
+            {'$sort': {sort_field: 1 if sort_field == 'price' else -1}},
+            {'$facet': {
+                'listings': [
+                    {'$skip': skip},
+                    {'$limit': limit},
+                    {'$project': projection}
+                ],
+                'total': [{'$count': 'n'}]
+            }}
+        ]))
+        total = result['total'][0]['n'] if result['total'] else 0
+        return result['listings'], total
 
     @require_role(['Seller', 'Both'])
     def post(self, current_user=None):
         """Create a new listing (sellers only)"""
-        try:
-            data = request.get_json()
-
-            # Validate required fields
-            required_fields = ['title', 'price', 'category', 'condition']
-            for field in required_fields:
-                if field not in data:
-                    return {'error': f'Missing required field: {field}'}, 400
-
-            # Use current authenticated user as seller
-            seller = current_user
-
-            # Verify user has seller privileges
-            if seller.role not in ['Seller', 'Both']:
-                return {'error': 'User is not authorized to sell'}, 403
-
-            # Create listing
-            listing = Listing(
-                seller_id=seller,
-                title=data['title'],
-                description=data.get('description', ''),
-                price=float(data['price']),
-                category=data['category'],
-                condition=data['condition'],
-                status=data.get('status', 'Draft')
-            )
-            listing.save()
+        data = get_json_body()
+
+        # Validate required fields
+        required_fields = ['title', 'price', 'category', 'condition']
+        for field in required_fields:
+            if field not in data:
+                return {'error': f'Missing required field: {field}'}, 400
+
+        # Use current authenticated user as seller
+        seller = current_user
+
+        # Verify user has seller privileges
+        if seller.role not in ['Seller', 'Both']:
+            return {'error': 'User is not authorized to sell'}, 403
 
-            return listing.to_dict(), 201
+        # Create listing
+        listing = Listing(
+            seller_id=seller.id,
+            title=data['title'],
+            description=data.get('description', ''),
+            price=parse_number(data, 'price', float),
+            category=data['category'],
+            condition=data['condition'],
+            status=data.get('status', 'Draft')
+        )
+        listing.save()
 
-        except Exception as e:
-            return {'error': str(e)}, 400
+        return listing.to_dict(), 201
 
 
 class ListingResource(Resource):
@@ -85,20 +127,23 @@ class ListingResource(Resource):
 
     def get(self, listing_id):
         """Get a specific listing"""
+        listing_oid = parse_oid(listing_id)
+        etag_key = f'listing:{listing_oid}:etag'
+        cached = not_modified(etag_key)
+        if cached:
+            return cached
+
         try:
-            listing = Listing.objects.get(id=ObjectId(listing_id))
-            return listing.to_dict(), 200
+            return document_response(Listing, listing_oid, etag_key)
         except Listing.DoesNotExist:
             return {'error': 'Listing not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
 
     @require_auth
     def patch(self, listing_id, current_user=None):
         """Update a listing (owner only)"""
         try:
-            data = request.get_json()
-            listing = Listing.objects.get(id=ObjectId(listing_id))
+            data = get_json_body()
+            listing = Listing.objects.get(id=parse_oid(listing_id))
 
             # Verify the current user is the seller/owner
             if not is_owner(current_user, listing):
@@ -110,7 +155,7 @@ class ListingResource(Resource):
             if 'description' in data:
                 listing.description = data['description']
             if 'price' in data:
-                listing.price = float(data['price'])
+                listing.price = parse_number(data, 'price', float)
             if 'category' in data:
                 listing.category = data['category']
             if 'condition' in data:
@@ -120,27 +165,25 @@ class ListingResource(Resource):
 
             listing.updated_at = datetime.utcnow()
             listing.save()
+            store_document_etag(f'listing:{listing.id}:etag', listing)
 
             return listing.to_dict(), 200
 
         except Listing.DoesNotExist:
             return {'error': 'Listing not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
 
     @require_auth
     def delete(self, listing_id, current_user=None):
         """Delete a listing (owner only)"""
         try:
-            listing = Listing.objects.get(id=ObjectId(listing_id))
+            listing = Listing.objects.get(id=parse_oid(listing_id))
 
             # Verify the current user is the seller/owner
             if not is_owner(current_user, listing):
                 return {'error': 'Only the listing owner can delete this listing'}, 403
 
             listing.delete()
+            expire_etags(f'listing:{listing.id}:etag', f'listing:{listing.id}:photos:etag')
             return {'message': 'Listing deleted successfully'}, 200
         except Listing.DoesNotExist:
-            return {'error': 'Listing not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
\ No newline at end of file
+            return {'error': 'Listing not found'}, 404
\ No newline at end of file
@@ -1,8 +1,60 @@
 from flask import request
 from flask_restful import Resource
-from models import Listing, ListingPhoto
-from bson import ObjectId
-from utils.auth_utils import require_auth, is_owner
+from models import Listing, ListingPhoto, raw_to_dict
+from pymongo import ReturnDocument
+from utils.auth_utils import require_auth
+from utils.validation import parse_oid, get_json_body, parse_number
+from utils.cache import not_modified, remember_etag, expire_etags
+
+
+def _find_photo_with_seller(listing_oid, photo_oid):
+    """Fetch a listing's photo and the listing's seller id in one round-trip"""
+    docs = list(ListingPhoto._get_collection().aggregate([
+        {'$match': {'_id': photo_oid, 'listing_id': listing_oid}},
+        {'$lookup': {
+            'from': Listing._get_collection_name(),
+            'localField': 'listing_id',
+            'foreignField': '_id',
+            'as': 'listing'
+        }},
+        {'$unwind': '$listing'},
+        {'$addFields': {'seller_id': '$listing.seller_id'}},
+        {'$project': {'listing': 0}}
+    ]))
+    if not docs:
+        return None, None
+
+    seller_id = docs[0].pop('seller_id')
+    return ListingPhoto._from_son(docs[0]), seller_id
+
+
+def _reserve_display_orders(listing_oid, seller_id, count):
+    """Advance a listing's photo_count by count, returning the updated listing"""
+    listings = Listing._get_collection()
+    query = {'_id': listing_oid, 'seller_id': seller_id}
+
+    def increment():
+        return listings.find_one_and_update(
+            dict(query, photo_count={'$exists': True}),
+            {'$inc': {'photo_count': count}},
+            projection={'photo_count': 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    listing = increment()
+    if listing is None:
+        # Listings created before photo_count existed start counting after
+        # the highest display order already in use
+        last = ListingPhoto._get_collection().find_one(
+            {'listing_id': listing_oid}, {'display_order': 1}, sort=[('display_order', -1)]
+        )
+        seeded = listings.update_one(
+            dict(query, photo_count={'$exists': False}),
+            {'$set': {'photo_count': last['display_order'] + 1 if last else 0}}
+        )
+        if seeded.matched_count:
+            listing = increment()
+    return listing
 
 
 class PhotoListResource(Resource):
@@ -10,53 +62,83 @@ class PhotoListResource(Resource):
 
     def get(self, listing_id):
         """Get all photos for a listing"""
-        try:
-            # Verify listing exists
-            listing = Listing.objects.get(id=ObjectId(listing_id))
-
-            photos = ListingPhoto.objects(listing_id=listing).order_by('display_order')
-            return {
-                'photos': [photo.to_dict() for photo in photos]
-            }, 200
-
-        except Listing.DoesNotExist:
+        listing_oid = parse_oid(listing_id)
+        etag_key = f'listing:{listing_oid}:photos:etag'
+        cached = not_modified(etag_key)
+        if cached:
+            return cached
+
+        # Verify listing exists
+        listing = Listing._get_collection().find_one({'_id': listing_oid}, {'_id': 1})
+        if listing is None:
             return {'error': 'Listing not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
+
+        photos = list(
+            ListingPhoto._get_collection()
+            .find({'listing_id': listing['_id']})
+            .sort('display_order', 1)
+        )
+        headers = remember_etag(
+            etag_key,
+            listing['_id'],
+            *(f"{photo['_id']}.{photo['display_order']}" for photo in photos)
+        )
+        return {
+            'photos': [raw_to_dict(ListingPhoto, photo) for photo in photos]
+        }, 200, headers
 
     @require_auth
     def post(self, listing_id, current_user=None):
-        """Add a photo to a listing (owner only)"""
-        try:
-            data = request.get_json()
-
-            # Validate required fields
-            if 'photo_url' not in data:
+        """Add a photo, or a list of photos, to a listing (owner only)"""
+        listing_oid = parse_oid(listing_id)
+        data = request.get_json()
+        is_batch = isinstance(data, list)
+        items = data if is_batch else [data]
+
+        # Validate required fields
+        if not items:
+            return {'error': 'No photos provided'}, 400
+        for item in items:
+            if not isinstance(item, dict):
+                return {'error': 'Each photo must be a JSON object'}, 400
+            if 'photo_url' not in item:
                 return {'error': 'Missing required field: photo_url'}, 400
 
-            # Verify listing exists
-            listing = Listing.objects.get(id=ObjectId(listing_id))
-
-            # Verify the current user is the listing owner
-            if not is_owner(current_user, listing):
+        # Reserve the next display orders atomically. Matching on seller_id
+        # also verifies the current user is the listing owner.
+        listing = _reserve_display_orders(listing_oid, current_user.id, len(items))
+        if listing is None:
+            if Listing.objects(id=listing_oid).count():
                 return {'error': 'Only the listing owner can add photos'}, 403
+            return {'error': 'Listing not found'}, 404
 
-            # Get the next display order
-            existing_photos = ListingPhoto.objects(listing_id=listing).count()
-
-            photo = ListingPhoto(
-                listing_id=listing,
-                photo_url=data['photo_url'],
-                display_order=data.get('display_order', existing_photos)
+        first_order = listing['photo_count'] - len(items)
+        photos = [
+            ListingPhoto(
+                listing_id=listing['_id'],
+                photo_url=item['photo_url'],
+                display_order=item.get('display_order', first_order + i)
             )
-            photo.save()
+            for i, item in enumerate(items)
+        ]
+
+        if is_batch:
+            # Insert the whole batch in a single round-trip
+            for photo in photos:
+                photo.validate()
+            result = ListingPhoto._get_collection().insert_many(
+                [photo.to_mongo() for photo in photos],
+                ordered=False
+            )
+            for photo, photo_id in zip(photos, result.inserted_ids):
+                photo.id = photo_id
+        else:
+            photos[0].save()
+        expire_etags(f'listing:{listing_oid}:photos:etag')
 
-            return photo.to_dict(), 201
-
-        except Listing.DoesNotExist:
-            return {'error': 'Listing not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
+        if is_batch:
+            return {'photos': [photo.to_dict() for photo in photos]}, 201
+        return photos[0].to_dict(), 201
 
 
 class PhotoResource(Resource):
@@ -65,43 +147,34 @@ class PhotoResource(Resource):
     @require_auth
     def patch(self, listing_id, photo_id, current_user=None):
         """Update photo order (owner only)"""
-        try:
-            listing = Listing.objects.get(id=ObjectId(listing_id))
-
-            # Verify the current user is the listing owner
-            if not is_owner(current_user, listing):
-                return {'error': 'Only the listing owner can update photos'}, 403
+        photo, seller_id = _find_photo_with_seller(parse_oid(listing_id), parse_oid(photo_id))
+        if photo is None:
+            return {'error': 'Listing or Photo not found'}, 404
 
-            photo = ListingPhoto.objects.get(id=ObjectId(photo_id), listing_id=listing)
+        # Verify the current user is the listing owner
+        if seller_id != current_user.id:
+            return {'error': 'Only the listing owner can update photos'}, 403
 
-            data = request.get_json()
-            if 'display_order' in data:
-                photo.display_order = int(data['display_order'])
-                photo.save()
+        data = get_json_body()
+        if 'display_order' in data:
+            photo.display_order = parse_number(data, 'display_order')
+            photo.save()
+            expire_etags(f'listing:{photo.listing_id}:photos:etag')
 
-            return photo.to_dict(), 200
-
-        except (Listing.DoesNotExist, ListingPhoto.DoesNotExist):
-            return {'error': 'Listing or Photo not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
+        return photo.to_dict(), 200
 
     @require_auth
     def delete(self, listing_id, photo_id, current_user=None):
         """Remove a photo (owner only)"""
-        try:
-            listing = Listing.objects.get(id=ObjectId(listing_id))
-
-            # Verify the current user is the listing owner
-            if not is_owner(current_user, listing):
-                return {'error': 'Only the listing owner can delete photos'}, 403
+        photo, seller_id = _find_photo_with_seller(parse_oid(listing_id), parse_oid(photo_id))
+        if photo is None:
+            return {'error': 'Listing or Photo not found'}, 404
 
-            photo = ListingPhoto.objects.get(id=ObjectId(photo_id), listing_id=listing)
-            photo.delete()
+        # Verify the current user is the listing owner
+        if seller_id != current_user.id:
+            return {'error': 'Only the listing owner can delete photos'}, 403
 
-            return {'message': 'Photo deleted successfully'}, 200
+        photo.delete()
+        expire_etags(f'listing:{photo.listing_id}:photos:etag')
 
-        except (Listing.DoesNotExist, ListingPhoto.DoesNotExist):
-            return {'error': 'Listing or Photo not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
\ No newline at end of file
+        return {'message': 'Photo deleted successfully'}, 200
\ No newline at end of file
@@ -1,9 +1,105 @@
 from flask import request
 from flask_restful import Resource
-from models import Review, Listing, User
-from bson import ObjectId
+from models import Review, Listing, User, raw_to_dict
+from mongoengine import NotUniqueError
 from datetime import datetime
 from utils.auth_utils import require_auth
+from utils.validation import parse_oid, parse_pagination, get_json_body, parse_number
+from utils.cache import not_modified, document_response, store_document_etag
+
+
+def _comment_requested():
+    """Review comments are only listed when requested with ?fields=comment"""
+    return 'comment' in request.args.get('fields', '').split(',')
+
+
+def _sync_user_rating(review, is_approved):
+    """Apply a moderation change to the reviewee's denormalized rating totals"""
+    sign = 1 if is_approved else -1
+    User.objects(id=review.reviewee_id).update_one(
+        inc__rating_sum=sign * review.rating,
+        inc__rating_count=sign
+    )
+
+
+def _hold_rating_seed(user_id):
+    """Block seeding of a legacy user's totals during a moderation; True if the user has none yet"""
+    # Seeding is only stored while no moderation is in flight and none has
+    # finished since its aggregate started, so it cannot miss this one
+    return bool(User._get_collection().update_one(
+        {'_id': user_id, 'rating_count': {'$exists': False}},
+        {'$inc': {'rating_pending': 1}}
+    ).matched_count)
+
+
+def _release_rating_seed(user_id):
+    User._get_collection().update_one(
+        {'_id': user_id},
+        {'$inc': {'rating_pending': -1, 'rating_changes': 1}}
+    )
+
+
+def _update_review(review, old_status, changes):
+    """Write changes unless the review's moderation status moved since it was read"""
+    for field, value in changes.items():
+        setattr(review, field, value)
+    review.validate()
+
+    was_approved = old_status == 'Approved'
+    is_approved = review.moderation_status == 'Approved'
+    unseeded = is_approved != was_approved and _hold_rating_seed(review.reviewee_id)
+
+    # Matching on the status that was read lets exactly one of several
+    # concurrent moderations win, so the totals are adjusted once
+    try:
+        updated = Review.objects(id=review.id, moderation_status=old_status).update_one(
+            **{f'set__{field}': value for field, value in changes.items()}
+        )
+    finally:
+        if unseeded:
+            _release_rating_seed(review.reviewee_id)
+    if not updated:
+        return False
+
+    # Totals that are not seeded yet will count this review when they are
+    if is_approved != was_approved and not unseeded:
+        _sync_user_rating(review, is_approved)
+    return True
+
+
+def _rating_totals(user_id):
+    """Return a user's (rating_sum, rating_count), or None if the user does not exist"""
+    users = User._get_collection()
+    user = users.find_one({'_id': user_id}, {'rating_sum': 1, 'rating_count': 1, 'rating_changes': 1})
+    if user is None:
+        return None
+
+    # Users created before the totals existed are seeded from their
+    # approved reviews on first read
+    if 'rating_count' not in user:
+        changes = user.get('rating_changes')
+        stats = list(Review._get_collection().aggregate([
+            {'$match': {'reviewee_id': user_id, 'moderation_status': 'Approved'}},
+            {'$group': {'_id': None, 'rating_sum': {'$sum': '$rating'}, 'rating_count': {'$sum': 1}}}
+        ]))
+        user = stats[0] if stats else {'rating_sum': 0, 'rating_count': 0}
+
+        # Stored only if no moderation raced the aggregate; otherwise a
+        # later read seeds again
+        users.update_one(
+            {
+                '_id': user_id,
+                'rating_count': {'$exists': False},
+                'rating_pending': {'$in': [0, None]},
+                'rating_changes': changes
+            },
+            {
+                '$set': {'rating_sum': user['rating_sum'], 'rating_count': user['rating_count']},
+                '$unset': {'rating_pending': '', 'rating_changes': ''}
+            }
+        )
+
+    return user['rating_sum'], user['rating_count']
 
 
 class ReviewListResource(Resource):
@@ -11,33 +107,32 @@ class ReviewListResource(Resource):
 
     def get(self):
         """Get all reviews (Admin only)"""
-        try:
-            # Get query parameters for pagination
-            page = int(request.args.get('page', 1))
-            per_page = int(request.args.get('per_page', 10))
-
-            # Pagination
-            skip = (page - 1) * per_page
-
-            reviews = Review.objects().order_by('-created_at').skip(skip).limit(per_page)
-            total = Review.objects().count()
-
-            return {
-                'reviews': [review.to_dict() for review in reviews],
-                'page': page,
-                'per_page': per_page,
-                'total': total,
-                'total_pages': (total + per_page - 1) // per_page
-            }, 200
-
-        except Exception as e:
-            return {'error': str(e)}, 400
+        # Get query parameters for pagination
+        page, per_page = parse_pagination()
+
+        # Pagination
+        skip = (page - 1) * per_page
+
+        exclude = () if _comment_requested() else ('comment',)
+        collection = Review._get_collection()
+        reviews = collection.find(
+            {}, {field: 0 for field in exclude} or None
+        ).sort('created_at', -1).skip(skip).limit(per_page)
+        total = collection.count_documents({})
+
+        return {
+            'reviews': [raw_to_dict(Review, review, exclude) for review in reviews],
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'total_pages': (total + per_page - 1) // per_page
+        }, 200
 
     @require_auth
     def post(self, current_user=None):
         """Create a new review (authenticated users only)"""
         try:
-            data = request.get_json()
+            data = get_json_body()
 
             # Validate required fields
             required_fields = ['listing_id', 'reviewee_id', 'rating']
@@ -46,33 +141,25 @@ class ReviewListResource(Resource):
                     return {'error': f'Missing required field: {field}'}, 400
 
             # Verify listing exists
-            listing = Listing.objects.get(id=ObjectId(data['listing_id']))
+            listing = Listing.objects.only('id').get(id=parse_oid(data['listing_id']))
 
             # Use current authenticated user as reviewer
             reviewer = current_user
 
             # Verify reviewee exists
-            reviewee = User.objects.get(id=ObjectId(data['reviewee_id']))
+            reviewee = User.objects.only('id').get(id=parse_oid(data['reviewee_id']))
 
             # Validate rating is between 1-5
-            rating = int(data['rating'])
+            rating = parse_number(data, 'rating')
             if rating < 1 or rating > 5:
                 return {'error': 'Rating must be between 1 and 5'}, 400
 
-            # Check if review already exists for this listing by this reviewer
-            existing_review = Review.objects(
-                listing_id=listing,
-                reviewer_id=reviewer
-            ).first()
-
-            if existing_review:
-                return {'error': 'You have already reviewed this listing'}, 400
-
-            # Create review
+            # Create review; the unique (listing_id, reviewer_id) index rejects
+            # a second review of the same listing by the same reviewer
             review = Review(
-                listing_id=listing,
-                reviewer_id=reviewer,
-                reviewee_id=reviewee,
+                listing_id=listing.id,
+                reviewer_id=reviewer.id,
+                reviewee_id=reviewee.id,
                 rating=rating,
                 comment=data.get('comment', '')
             )
@@ -80,10 +167,10 @@ class ReviewListResource(Resource):
 
             return review.to_dict(), 201
 
+        except NotUniqueError:
+            return {'error': 'You have already reviewed this listing'}, 400
         except (Listing.DoesNotExist, User.DoesNotExist):
             return {'error': 'Listing or User not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
 
 
 class ReviewResource(Resource):
@@ -91,59 +178,66 @@ class ReviewResource(Resource):
 
     def get(self, review_id):
         """Get a specific review"""
+        review_oid = parse_oid(review_id)
+        etag_key = f'review:{review_oid}:etag'
+        cached = not_modified(etag_key)
+        if cached:
+            return cached
+
         try:
-            review = Review.objects.get(id=ObjectId(review_id))
-            return review.to_dict(), 200
+            return document_response(Review, review_oid, etag_key)
         except Review.DoesNotExist:
             return {'error': 'Review not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
 
     @require_auth
     def patch(self, review_id, current_user=None):
         """Update review (helpful count or moderation status) - authenticated users"""
         try:
-            review = Review.objects.get(id=ObjectId(review_id))
-            data = request.get_json()
+            review = Review.objects.get(id=parse_oid(review_id))
+            old_status = review.moderation_status
+            data = get_json_body()
 
             # Update allowed fields
+            changes = {}
             if 'helpful_count' in data:
-                review.helpful_count = int(data['helpful_count'])
+                changes['helpful_count'] = parse_number(data, 'helpful_count')
             if 'is_flagged' in data:
-                review.is_flagged = data['is_flagged']
+                changes['is_flagged'] = data['is_flagged']
             if 'moderation_status' in data:
                 if data['moderation_status'] in ['Pending', 'Approved', 'Rejected']:
-                    review.moderation_status = data['moderation_status']
+                    changes['moderation_status'] = data['moderation_status']
                 else:
                     return {'error': 'Invalid moderation status'}, 400
+            changes['updated_at'] = datetime.utcnow()
 
-            review.updated_at = datetime.utcnow()
-            review.save()
+            if not _update_review(review, old_status, changes):
+                return {'error': 'Review was changed by another request, please retry'}, 409
+            store_document_etag(f'review:{review.id}:etag', review)
 
             return review.to_dict(), 200
 
         except Review.DoesNotExist:
             return {'error': 'Review not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
 
     @require_auth
     def delete(self, review_id, current_user=None):
         """Delete a review (soft delete by marking as rejected) - admin/authenticated users"""
         try:
-            review = Review.objects.get(id=ObjectId(review_id))
+            review = Review.objects.get(id=parse_oid(review_id))
 
             # Soft delete: mark as rejected instead of actually deleting
-            review.moderation_status = 'Rejected'
-            review.is_flagged = True
-            review.updated_at = datetime.utcnow()
-            review.save()
+            changes = {
+                'moderation_status': 'Rejected',
+                'is_flagged': True,
+                'updated_at': datetime.utcnow()
+            }
+            if not _update_review(review, review.moderation_status, changes):
+                return {'error': 'Review was changed by another request, please retry'}, 409
+            store_document_etag(f'review:{review.id}:etag', review)
 
             return {'message': 'Review deleted successfully'}, 200
         except Review.DoesNotExist:
             return {'error': 'Review not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
 
 
 class ListingReviewListResource(Resource):
@@ -151,24 +245,40 @@ class ListingReviewListResource(Resource):
 
     def get(self, listing_id):
         """Get all reviews for a listing"""
-        try:
-            # Verify listing exists
-            listing = Listing.objects.get(id=ObjectId(listing_id))
-
-            # Get only approved reviews
-            reviews = Review.objects(
-                listing_id=listing,
-                moderation_status='Approved'
-            ).order_by('-created_at')
+        # Get query parameters for pagination
+        page, per_page = parse_pagination()
 
-            return {
-                'reviews': [review.to_dict() for review in reviews]
-            }, 200
-
-        except Listing.DoesNotExist:
+        # Verify listing exists
+        listing = Listing._get_collection().find_one({'_id': parse_oid(listing_id)}, {'_id': 1})
+        if listing is None:
             return {'error': 'Listing not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
+
+        # Pagination
+        skip = (page - 1) * per_page
+        page_stages = [{'$skip': skip}, {'$limit': per_page}]
+        exclude = ()
+        if not _comment_requested():
+            page_stages.append({'$project': {'comment': 0}})
+            exclude = ('comment',)
+
+        # Get only approved reviews, with the total in the same round-trip
+        result = next(Review._get_collection().aggregate([
+            {'$match': {'listing_id': listing['_id'], 'moderation_status': 'Approved'}},
+            {'$sort': {'created_at': -1}},
+            {'$facet': {
+                'reviews': page_stages,
+                'total': [{'$count': 'n'}]
+            }}
+        ]))
+        total = result['total'][0]['n'] if result['total'] else 0
+
+        return {
+            'reviews': [raw_to_dict(Review, doc, exclude) for doc in result['reviews']],
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'total_pages': (total + per_page - 1) // per_page
+        }, 200
 
 
 class UserReviewListResource(Resource):
@@ -176,27 +286,33 @@ class UserReviewListResource(Resource):
 
     def get(self, user_id):
         """Get all reviews received by a user"""
-        try:
-            # Verify user exists
-            user = User.objects.get(id=ObjectId(user_id))
-
-            # Get all approved reviews for this user
-            reviews = Review.objects(
-                reviewee_id=user,
-                moderation_status='Approved'
-            ).order_by('-created_at')
-
-            # Calculate average rating
-            total_rating = sum(review.rating for review in reviews)
-            avg_rating = total_rating / len(reviews) if len(reviews) > 0 else 0
-
-            return {
-                'reviews': [review.to_dict() for review in reviews],
-                'total_reviews': len(reviews),
-                'average_rating': round(avg_rating, 2)
-            }, 200
-
-        except User.DoesNotExist:
+        # Get query parameters for pagination
+        page, per_page = parse_pagination()
+
+        # Verify user exists and read the stored rating totals
+        user_oid = parse_oid(user_id)
+        totals = _rating_totals(user_oid)
+        if totals is None:
             return {'error': 'User not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
+        rating_sum, rating_count = totals
+
+        # Pagination
+        skip = (page - 1) * per_page
+
+        # Get a page of approved reviews for this user
+        exclude = () if _comment_requested() else ('comment',)
+        reviews = Review._get_collection().find(
+            {'reviewee_id': user_oid, 'moderation_status': 'Approved'},
+            {field: 0 for field in exclude} or None
+        ).sort('created_at', -1).skip(skip).limit(per_page)
+
+        # Average rating from the denormalized totals
+        avg_rating = rating_sum / rating_count if rating_count else 0
+
+        return {
+            'reviews': [raw_to_dict(Review, review, exclude) for review in reviews],
+            'page': page,
+            'per_page': per_page,
+            'total_reviews': rating_count,
+            'average_rating': round(avg_rating, 2)
+        }, 200
@@ -1,7 +1,10 @@
-from flask import request
 from flask_restful import Resource
 from models import User
-from utils.auth_utils import hash_password, verify_password, generate_token, require_auth
+from utils.auth_utils import (
+    hash_password, verify_password, spend_password_check, needs_rehash,
+    generate_token, require_auth, get_token_from_header, revoke_token
+)
+from utils.validation import get_json_body
 
 
 class SessionResource(Resource):
@@ -9,44 +12,52 @@ class SessionResource(Resource):
 
     def post(self):
         """User login - creates a session (JWT token)"""
-        try:
-            data = request.get_json()
-
-            # Validate required fields
-            if 'email' not in data or 'password' not in data:
-                return {'error': 'Email and password are required'}, 400
-
-            # Find user by email
-            try:
-                user = User.objects.get(email=data['email'])
-            except User.DoesNotExist:
-                return {'error': 'Invalid email or password'}, 401
-
-            # Verify password
-            if not verify_password(data['password'], user.password):
-                return {'error': 'Invalid email or password'}, 401
-
-            # Generate JWT token
-            token = generate_token(user.id)
-
-            return {
-                'token': token,
-                'user': user.to_dict(),
-                'message': 'Login successful'
-            }, 200
-
-        except Exception as e:
-            return {'error': str(e)}, 400
+        data = get_json_body()
+
+        # Validate required fields
+        if 'email' not in data or 'password' not in data:
+            return {'error': 'Email and password are required'}, 400
+
+        # Anything but strings could reach MongoDB as a query operator,
+        # e.g. {"$ne": null} matching every user
+        if not isinstance(data['email'], str) or not isinstance(data['password'], str):
+            return {'error': 'Email and password must be strings'}, 400
+
+        # Find user by email, loading only what login and the response use
+        user = User.objects(email=data['email']).only(
+            'id', 'name', 'email', 'role', 'verified', 'created_at', 'password'
+        ).first()
+        if user is None:
+            # Answer as slowly as for a wrong password so response times do
+            # not reveal which emails are registered
+            spend_password_check(data['password'])
+            return {'error': 'Invalid email or password'}, 401
+
+        # Verify password
+        if not verify_password(data['password'], user.password):
+            return {'error': 'Invalid email or password'}, 401
+
+        # Upgrade hashes made with an older work factor while the plain
+        # password is at hand
+        if needs_rehash(user.password):
+            user.password = hash_password(data['password'])
+            User.objects(id=user.id).update_one(set__password=user.password)
+
+        # Generate JWT token
+        token = generate_token(user.id)
+
+        return {
+            'token': token,
+            'user': user.to_dict(),
+            'message': 'Login successful'
+        }, 200
 
     @require_auth
     def delete(self, current_user=None):
         """User logout - invalidates the current session"""
-        try:
-            # With JWT, logout is handled client-side by removing the token
-            # Server-side, we just confirm the user is authenticated
-            return {
-                'message': 'Logout successful. Please remove the token from client storage.'
-            }, 200
-
-        except Exception as e:
-            return {'error': str(e)}, 400
+        # Server-side, the token is revoked until it expires
+        revoke_token(get_token_from_header())
+
+        return {
+            'message': 'Logout successful. Please remove the token from client storage.'
+        }, 200
@@ -1,9 +1,41 @@
 from flask import request
 from flask_restful import Resource
-from models import Listing, ChatThread, User
-from bson import ObjectId
+from models import Listing, ChatThread, User, raw_to_dict
+from pymongo import ReturnDocument
 from datetime import datetime
 from utils.auth_utils import require_auth, require_role, is_owner, is_thread_participant
+from utils.validation import parse_oid, parse_pagination
+from utils.cache import cache_get, cache_set, cache_delete
+
+THREAD_COUNT_TTL_SECONDS = 60
+
+# ?page= is served with skip(), which walks every skipped thread, so only
+# the first few pages are reachable that way; later ones use ?before=
+MAX_SKIP_PAGE = 10
+
+
+def _thread_count_key(user_id):
+    """Redis key of the cached number of threads a user takes part in"""
+    return f'user:{user_id}:thread_count'
+
+
+def _thread_cursor(thread):
+    """Cursor addressing the threads listed after this one"""
+    return f'{thread.last_activity_time.isoformat()}_{thread.id}'
+
+
+def _before_cursor_filter(cursor):
+    """Match threads ordered after a cursor by (-last_activity_time, -_id)"""
+    # Threads sharing the cursor's timestamp are told apart by _id, so none
+    # is skipped at a page boundary
+    timestamp, _, thread_id = cursor.partition('_')
+    last_activity_time = datetime.fromisoformat(timestamp)
+    return {
+        '$or': [
+            {'last_activity_time': {'$lt': last_activity_time}},
+            {'last_activity_time': last_activity_time, '_id': {'$lt': parse_oid(thread_id)}}
+        ]
+    }
 
 
 class ThreadListResource(Resource):
@@ -13,13 +45,13 @@ class ThreadListResource(Resource):
     def get(self, listing_id, current_user=None):
         """Get all threads for a listing (owner only)"""
         try:
-            listing = Listing.objects.get(id=ObjectId(listing_id))
+            listing = Listing.objects.get(id=parse_oid(listing_id))
 
             # Only the listing owner can see all threads
             if not is_owner(current_user, listing):
                 return {'error': 'Only the listing owner can view all threads'}, 403
 
-            threads = ChatThread.objects(listing_id=listing).order_by('-last_activity_time')
+            threads = ChatThread.objects(listing_id=listing.id).order_by('-last_activity_time')
 
             return {
                 'threads': [thread.to_dict() for thread in threads]
@@ -27,23 +59,21 @@ class ThreadListResource(Resource):
 
         except Listing.DoesNotExist:
             return {'error': 'Listing not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
 
     @require_role(['Buyer', 'Both'])
     def post(self, listing_id, current_user=None):
         """Start a chat thread (buyers only)"""
         try:
             # Verify listing exists
-            listing = Listing.objects.get(id=ObjectId(listing_id))
+            listing = Listing.objects.get(id=parse_oid(listing_id))
 
             # Use current authenticated user as buyer
             buyer = current_user
 
             # Check if thread already exists
             existing_thread = ChatThread.objects(
-                listing_id=listing,
-                buyer_id=buyer
+                listing_id=listing.id,
+                buyer_id=buyer.id
             ).first()
 
             if existing_thread:
@@ -51,18 +81,17 @@ class ThreadListResource(Resource):
 
             # Create new thread
             thread = ChatThread(
-                listing_id=listing,
-                buyer_id=buyer,
+                listing_id=listing.id,
+                buyer_id=buyer.id,
                 seller_id=listing.seller_id
             )
             thread.save()
+            cache_delete(_thread_count_key(buyer.id), _thread_count_key(listing.seller_id))
 
             return thread.to_dict(), 201
 
         except Listing.DoesNotExist:
             return {'error': 'Listing not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
 
 
 class ThreadResource(Resource):
@@ -72,8 +101,8 @@ class ThreadResource(Resource):
     def get(self, listing_id, thread_id, current_user=None):
         """Get a specific thread (participants only)"""
         try:
-            listing = Listing.objects.get(id=ObjectId(listing_id))
-            thread = ChatThread.objects.get(id=ObjectId(thread_id), listing_id=listing)
+            # A thread under a missing listing is simply not found
+            thread = ChatThread.objects.get(id=parse_oid(thread_id), listing_id=parse_oid(listing_id))
 
             # Verify user is a participant
             if not is_thread_participant(current_user, thread):
@@ -81,34 +110,28 @@ class ThreadResource(Resource):
 
             return thread.to_dict(), 200
 
-        except (Listing.DoesNotExist, ChatThread.DoesNotExist):
+        except ChatThread.DoesNotExist:
             return {'error': 'Listing or Thread not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
 
     @require_auth
     def patch(self, listing_id, thread_id, current_user=None):
         """Update thread (participants only)"""
-        try:
-            listing = Listing.objects.get(id=ObjectId(listing_id))
-            thread = ChatThread.objects.get(id=ObjectId(thread_id), listing_id=listing)
-
-            # Verify user is a participant
-            if not is_thread_participant(current_user, thread):
+        # A thread under a missing listing is simply not found
+        query = {'_id': parse_oid(thread_id), 'listing_id': parse_oid(listing_id)}
+
+        # Update last activity time. Matching on the participants also
+        # verifies the user takes part in the thread.
+        thread = ChatThread._get_collection().find_one_and_update(
+            dict(query, **{'$or': [{'buyer_id': current_user.id}, {'seller_id': current_user.id}]}),
+            {'$set': {'last_activity_time': datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if thread is None:
+            if ChatThread.objects(__raw__=query).count():
                 return {'error': 'Only thread participants can update this thread'}, 403
-
-            data = request.get_json()
-
-            # Update last activity time
-            thread.last_activity_time = datetime.utcnow()
-            thread.save()
-
-            return thread.to_dict(), 200
-
-        except (Listing.DoesNotExist, ChatThread.DoesNotExist):
             return {'error': 'Listing or Thread not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
+
+        return raw_to_dict(ChatThread, thread), 200
 
 
 class StandaloneThreadListResource(Resource):
@@ -116,44 +139,56 @@ class StandaloneThreadListResource(Resource):
 
     @require_auth
     def get(self, current_user=None):
-        """Get all threads for current user"""
-        try:
-            # Get query parameters
-            page = int(request.args.get('page', 1))
-            per_page = int(request.args.get('per_page', 10))
-
-            # Use current authenticated user
-            user = current_user
-
-            # Find threads where user is buyer or seller
-            skip = (page - 1) * per_page
-            threads = ChatThread.objects(
-                __raw__={
-                    '$or': [
-                        {'buyer_id': user.id},
-                        {'seller_id': user.id}
-                    ]
-                }
-            ).order_by('-last_activity_time').skip(skip).limit(per_page)
-
-            total = ChatThread.objects(
-                __raw__={
-                    '$or': [
-                        {'buyer_id': user.id},
-                        {'seller_id': user.id}
-                    ]
-                }
-            ).count()
-
-            return {
-                'threads': [thread.to_dict() for thread in threads],
-                'page': page,
-                'per_page': per_page,
-                'total': total
-            }, 200
-
-        except Exception as e:
-            return {'error': str(e)}, 400
+        """Get all threads for current user, most recently active first"""
+        # Get query parameters. Pages are addressed with ?before=<cursor> (the
+        # previous response's next_before); ?page= still reaches the first pages.
+        before = request.args.get('before')
+        page, per_page = parse_pagination()
+        include_total = request.args.get('include_total') in ('1', 'true')
+        if page > MAX_SKIP_PAGE and not before:
+            return {'error': f'page must be at most {MAX_SKIP_PAGE}; use before=<next_before> for later pages'}, 400
+
+        # Use current authenticated user
+        user = current_user
+
+        # Find threads where user is buyer or seller
+        query = {
+            '$or': [
+                {'buyer_id': user.id},
+                {'seller_id': user.id}
+            ]
+        }
+        page_query = query
+        if before:
+            page_query = {'$and': [query, _before_cursor_filter(before)]}
+        threads = ChatThread.objects(__raw__=page_query).order_by('-last_activity_time', '-id')
+        if not before:
+            threads = threads.skip((page - 1) * per_page)
+        # Fetch one extra thread to tell whether another page follows
+        threads = list(threads.limit(per_page + 1))
+        has_more = len(threads) > per_page
+        threads = threads[:per_page]
+
+        result = {
+            'threads': [thread.to_dict() for thread in threads],
+            'per_page': per_page,
+            'has_more': has_more,
+            'next_before': _thread_cursor(threads[-1]) if has_more else None
+        }
+        if not before:
+            result['page'] = page
+
+        # Counting walks every matching thread, so it is only done on request
+        # and the result is cached briefly
+        if include_total:
+            count_key = _thread_count_key(user.id)
+            total = cache_get(count_key)
+            if total is None:
+                total = ChatThread.objects(__raw__=query).count()
+                cache_set(count_key, total, THREAD_COUNT_TTL_SECONDS)
+            result['total'] = int(total)
+
+        return result, 200
 
 
 class StandaloneThreadResource(Resource):
@@ -163,7 +198,7 @@ class StandaloneThreadResource(Resource):
     def get(self, thread_id, current_user=None):
         """Get a specific thread (participants only)"""
         try:
-            thread = ChatThread.objects.get(id=ObjectId(thread_id))
+            thread = ChatThread.objects.get(id=parse_oid(thread_id))
 
             # Verify user is a participant
             if not is_thread_participant(current_user, thread):
@@ -172,5 +207,3 @@ class StandaloneThreadResource(Resource):
             return thread.to_dict(), 200
         except ChatThread.DoesNotExist:
             return {'error': 'Thread not found'}, 404
-        except Exception as e:
-            return {'error': str(e)}, 400
@@ -1,25 +1,92 @@
-import jwt
-import bcrypt
+import time
+import hashlib
+import orjson
+import threading
+from cachetools import TTLCache
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import request
+from flask import request, g
 from models import User
 from bson import ObjectId
+from utils.cache import cache_get, cache_set
 
 # Secret key for JWT - in production, this should be in environment variables
 SECRET_KEY = 'campustrade-secret-key-2024'
 ALGORITHM = 'HS256'
 TOKEN_EXPIRATION_HOURS = 24
+# bcrypt work factor for new hashes; each step down halves the hashing cost
+BCRYPT_ROUNDS = 10
+USER_CACHE_TTL_SECONDS = 60
+TOKEN_CACHE_TTL_SECONDS = 30
+
+# Per-process cache of resolved users, keyed by token hash: (user, exp)
+_token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL_SECONDS)
+_token_cache_lock = threading.Lock()
+
+# Recent successful password checks, keyed by a digest of hash + password
+_password_cache = TTLCache(maxsize=1000, ttl=60)
+_password_cache_lock = threading.Lock()
+
+# bcrypt and PyJWT are only loaded by the first request that needs them
+_bcrypt = None
+_jwt = None
+
+# Hash checked against when a login names an unknown email
+_dummy_hash = None
+
+
+def _get_bcrypt():
+    global _bcrypt
+    if _bcrypt is None:
+        import bcrypt
+        _bcrypt = bcrypt
+    return _bcrypt
+
+
+def _get_jwt():
+    global _jwt
+    if _jwt is None:
+        import jwt
+        _jwt = jwt
+    return _jwt
 
 
 def hash_password(password):
     """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    bcrypt = _get_bcrypt()
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
 
 
 def verify_password(plain_password, hashed_password):
     """Verify a password against its hash"""
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    # Only matches are cached, so failed guesses always pay the full bcrypt
+    # cost; a changed password has a new hash and therefore a new key
+    key = hashlib.sha256((hashed_password + plain_password).encode('utf-8')).hexdigest()
+    with _password_cache_lock:
+        if key in _password_cache:
+            return True
+
+    if not _get_bcrypt().checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8')):
+        return False
+
+    with _password_cache_lock:
+        _password_cache[key] = True
+    return True
+
+
+def spend_password_check(plain_password):
+    """Take as long as a real password check, for logins with an unknown email"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password('campustrade-dummy-password')
+    # Bypasses the verify_password cache so the cost is always paid
+    _get_bcrypt().checkpw(plain_password.encode('utf-8'), _dummy_hash.encode('utf-8'))
+
+
+def needs_rehash(hashed_password):
+    """Check whether a hash was made with a work factor other than BCRYPT_ROUNDS"""
+    # bcrypt hashes look like $2b$<rounds>$<salt and digest>
+    return int(hashed_password.split('$')[2]) != BCRYPT_ROUNDS
 
 
 def generate_token(user_id):
@@ -29,46 +96,125 @@ def generate_token(user_id):
         'exp': datetime.utcnow() + timedelta(hours=TOKEN_EXPIRATION_HOURS),
         'iat': datetime.utcnow()
     }
-    token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+    token = _get_jwt().encode(payload, SECRET_KEY, algorithm=ALGORITHM)
     return token
 
 
 def decode_token(token):
     """Decode and validate a JWT token"""
+    jwt = _get_jwt()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
+    # A token revoked at logout is still signed and unexpired
+    if cache_get(_revoked_key(token)):
+        return None
+    return payload
+
 
-def get_current_user_from_token():
-    """Get the current user from the JWT token in the Authorization header"""
+def get_token_from_header():
+    """Get the raw JWT token from the Authorization header"""
     auth_header = request.headers.get('Authorization')
     if not auth_header:
         return None
 
     try:
         # Extract token from "Bearer <token>" format
-        token = auth_header.split(' ')[1]
-        payload = decode_token(token)
+        return auth_header.split(' ')[1]
+    except IndexError:
+        return None
+
 
-        if not payload:
+def _token_hash(token):
+    """Hash a token so it can be used as a cache key without storing it"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _revoked_key(token):
+    """Redis key marking a token as revoked"""
+    return 'revoked:' + _token_hash(token)
+
+
+def _remember_user(token_hash, user, exp):
+    """Keep a resolved user in the per-process token cache"""
+    with _token_cache_lock:
+        _token_cache[token_hash] = (user, exp)
+
+
+def revoke_token(token):
+    """Reject a token from now until it expires"""
+    payload = decode_token(token)
+    if payload:
+        ttl = int(payload['exp'] - time.time())
+        if ttl > 0:
+            cache_set(_revoked_key(token), 1, ttl)
+
+    with _token_cache_lock:
+        _token_cache.pop(_token_hash(token), None)
+
+
+def get_current_user_from_token():
+    """Get the current user from the JWT token in the Authorization header"""
+    token = get_token_from_header()
+    if not token:
+        return None
+
+    # Users resolved by a recent request with the same token are cached in
+    # this process. Only successful lookups are ever cached.
+    token_hash = _token_hash(token)
+    with _token_cache_lock:
+        entry = _token_cache.get(token_hash)
+    if entry and entry[1] > time.time():
+        # Logout on any worker revokes the token in Redis, so the
+        # denylist is still checked before trusting this process's cache
+        if cache_get(_revoked_key(token)):
+            with _token_cache_lock:
+                _token_cache.pop(token_hash, None)
             return None
+        return entry[0]
 
-        user = User.objects.get(id=ObjectId(payload['user_id']))
-        return user
-    except (IndexError, User.DoesNotExist):
+    payload = decode_token(token)
+    if not payload:
         return None
 
+    # The user record itself is cached in Redis, shared by every worker
+    user_key = f"user:{payload['user_id']}"
+    cached = cache_get(user_key)
+    if cached:
+        data = orjson.loads(cached)
+        user = User(id=ObjectId(data['id']), role=data['role'], verified=data['verified'])
+    else:
+        try:
+            user = User.objects.get(id=ObjectId(payload['user_id']))
+        except User.DoesNotExist:
+            return None
+
+        # Never cache a user beyond the token's own expiry
+        ttl = min(USER_CACHE_TTL_SECONDS, int(payload['exp'] - time.time()))
+        if ttl > 0:
+            data = {'id': str(user.id), 'role': user.role, 'verified': user.verified}
+            cache_set(user_key, orjson.dumps(data), ttl)
+
+    _remember_user(token_hash, user, payload['exp'])
+    return user
+
+
+def get_request_user():
+    """Resolve the request's user once and share it through flask.g"""
+    if 'current_user' not in g:
+        g.current_user = get_current_user_from_token()
+    return g.current_user
+
 
 def require_auth(f):
     """Decorator to require authentication for a route"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        user = get_current_user_from_token()
+        user = get_request_user()
         if user is None:
             return {'error': 'Authentication required'}, 401
 
@@ -84,7 +230,7 @@ def require_role(allowed_roles):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            user = get_current_user_from_token()
+            user = get_request_user()
             if user is None:
                 return {'error': 'Authentication required'}, 401
 
@@ -103,10 +249,10 @@ def require_role(allowed_roles):
 def is_owner(user, resource):
     """Check if user owns a resource (for listings)"""
     if hasattr(resource, 'seller_id'):
-        return str(resource.seller_id.id) == str(user.id)
+        return resource.seller_id == user.id
     return False
 
 
 def is_thread_participant(user, thread):
     """Check if user is a participant in a thread"""
-    return str(user.id) in [str(thread.buyer_id.id), str(thread.seller_id.id)]
+    return user.id == thread.buyer_id or user.id == thread.seller_id
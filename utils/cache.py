@@ -0,0 +1,103 @@
+import hashlib
+import redis
+from functools import lru_cache
+from flask import request, Response
+from models import raw_to_dict
+from utils.json_encoder import dumps
+
+# Redis connection - in production, this should be in environment variables
+redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
+
+ETAG_TTL_SECONDS = 300
+# How long after a write reads are kept from caching ETags they computed
+ETAG_WRITE_GUARD_SECONDS = 5
+
+
+def cache_get(key):
+    """Read a key from Redis, treating an unavailable cache as a miss"""
+    try:
+        return redis_client.get(key)
+    except redis.RedisError:
+        return None
+
+
+def cache_set(key, value, ttl, nx=False):
+    """Store a key in Redis with a TTL, ignoring cache outages"""
+    try:
+        redis_client.set(key, value, ex=ttl, nx=nx)
+    except redis.RedisError:
+        pass
+
+
+def cache_delete(*keys):
+    """Delete keys from Redis, ignoring cache outages"""
+    try:
+        redis_client.delete(*keys)
+    except redis.RedisError:
+        pass
+
+
+def make_etag(*parts):
+    """Build an ETag from the values that identify one version of a resource"""
+    return hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def not_modified(key):
+    """Return a 304 response if If-None-Match carries the ETag cached under key"""
+    if not request.if_none_match:
+        return None
+
+    etag = cache_get(key)
+    if etag and etag in request.if_none_match:
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    return None
+
+
+def remember_etag(key, *parts):
+    """Compute an ETag on a read, cache it under key and return the headers carrying it"""
+    etag = make_etag(*parts)
+    # A read only fills an empty key, so it never replaces the ETag or the
+    # guard stored by a write that finished while it was in flight
+    cache_set(key, etag, ETAG_TTL_SECONDS, nx=True)
+    return {'ETag': f'"{etag}"'}
+
+
+def _document_etag_parts(document_id, updated_at):
+    # MongoDB keeps milliseconds, so a freshly saved updated_at is truncated
+    # to match what later reads of the same version see
+    return document_id, updated_at.replace(microsecond=updated_at.microsecond // 1000 * 1000).timestamp()
+
+
+def store_document_etag(key, document):
+    """Cache the ETag of a document version that was just written"""
+    cache_set(key, make_etag(*_document_etag_parts(document.id, document.updated_at)), ETAG_TTL_SECONDS)
+
+
+def expire_etags(*keys):
+    """Stop serving cached ETags for resources that were changed or deleted"""
+    # An empty guard, unlike a deleted key, also keeps reads that started
+    # before the write from caching the ETag of the old version
+    for key in keys:
+        cache_set(key, '', ETAG_WRITE_GUARD_SECONDS)
+
+
+@lru_cache(maxsize=4096)
+def serialize_document(document_cls, document_id, updated_at):
+    """Return the JSON body of one version of a document"""
+    # updated_at is part of the cache key, so an edit turns into a miss and the
+    # superseded entry ages out of the LRU without explicit invalidation
+    doc = document_cls._get_collection().find_one({'_id': document_id})
+    if doc is None:
+        # Deleted since its updated_at was read
+        raise document_cls.DoesNotExist
+    return dumps(raw_to_dict(document_cls, doc))
+
+
+def document_response(document_cls, document_id, etag_key):
+    """Build the 200 response for a single-document GET from the cached body"""
+    doc = document_cls._get_collection().find_one({'_id': document_id}, {'updated_at': 1})
+    if doc is None:
+        raise document_cls.DoesNotExist
+    body = serialize_document(document_cls, doc['_id'], doc['updated_at'])
+    headers = remember_etag(etag_key, *_document_etag_parts(doc['_id'], doc['updated_at']))
+    return Response(body, status=200, headers=headers, mimetype='application/json')
@@ -1,11 +1,49 @@
-from flask.json.provider import DefaultJSONProvider
+import orjson
 from bson import ObjectId
-from datetime import datetime
+from flask import make_response
+from flask.json.provider import DefaultJSONProvider
+
+# Encoders for values orjson has no native support for, keyed by exact type.
+# datetime, UUID and the JSON-native types never reach this table.
+_ENCODERS = {
+    ObjectId: str,
+    set: list,
+    frozenset: list
+}
+
+
+def _ejson_default(obj):
+    """Encode values orjson has no native support for, such as ObjectId"""
+    return _ENCODERS.get(type(obj), str)(obj)
+
+
+def dumps(obj):
+    """Encode obj to JSON bytes with orjson"""
+    return orjson.dumps(obj, default=_ejson_default, option=orjson.OPT_NON_STR_KEYS)
+
 
 class MongodbJSONProvider(DefaultJSONProvider):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
\ No newline at end of file
+    def dumps(self, obj, **kwargs):
+        # orjson serializes datetimes natively, in the same format as isoformat()
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def iter_json_list(key, items, **fields):
+    """Encode {key: [...items], **fields} incrementally, one item at a time"""
+    yield b'{' + dumps(key) + b':['
+    for i, item in enumerate(items):
+        yield (b',' if i else b'') + dumps(item)
+    yield b']'
+    for name, value in fields.items():
+        yield b',' + dumps(name) + b':' + dumps(value)
+    yield b'}'
+
+
+def output_json(data, code, headers=None):
+    """Flask-RESTful representation that encodes responses with orjson"""
+    resp = make_response(dumps(data), code)
+    resp.headers.extend(headers or {})
+    return resp
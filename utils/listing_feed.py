@@ -0,0 +1,166 @@
+import bisect
+import logging
+import threading
+import time
+from datetime import datetime
+from pymongo.errors import OperationFailure, PyMongoError
+from models import Listing
+
+logger = logging.getLogger(__name__)
+
+SORT_FIELDS = ('created_at', 'price')
+
+# Backoff between attempts to reopen the change stream
+RETRY_MIN_SECONDS = 1
+RETRY_MAX_SECONDS = 60
+
+# Server error codes: change streams on a standalone server, and a resume
+# point that has already left the oplog
+CHANGE_STREAMS_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+class ListingFeed:
+    """In-process copy of the published listings, kept current by a change stream"""
+
+    def __init__(self):
+        self.ready = False
+        self._lock = threading.Lock()
+        self._docs = {}
+        # (category or None, sort field) -> ascending list of (value, _id) keys
+        self._index = {}
+        self._resume_token = None
+        self._retry_delay = RETRY_MIN_SECONDS
+
+    def start(self):
+        """Load the published listings and follow changes in a daemon thread"""
+        threading.Thread(target=self._run, name='listing-feed', daemon=True).start()
+
+    def page(self, category, sort_by, skip, limit):
+        """Return (docs, total) for one page, or None while the feed is not ready"""
+        with self._lock:
+            if not self.ready:
+                return None
+
+            keys = self._index.get((category, sort_by), [])
+            total = len(keys)
+            if sort_by == 'price':
+                window = keys[skip:skip + limit]
+            else:
+                # Newest first: walk the ascending created_at keys from the end
+                end = max(total - skip, 0)
+                window = keys[max(end - limit, 0):end][::-1]
+            return [self._docs[key[-1]] for key in window], total
+
+    def _run(self):
+        while True:
+            try:
+                self._follow()
+                # The stream was invalidated, e.g. by dropping the collection,
+                # so the next one starts over from a fresh load
+                self._resume_token = None
+                continue
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    # Change streams need a replica set; on a standalone
+                    # server the listings page keeps querying MongoDB directly
+                    self._stop()
+                    logger.warning('Listing feed disabled: %s', e)
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    self._resume_token = None
+                logger.warning('Listing feed interrupted, retrying in %ss: %s', self._retry_delay, e)
+            except PyMongoError as e:
+                logger.warning('Listing feed interrupted, retrying in %ss: %s', self._retry_delay, e)
+            except Exception:
+                # The in-memory state may be half updated, so the next
+                # attempt reloads it instead of resuming
+                self._resume_token = None
+                logger.exception('Listing feed failed, retrying in %ss', self._retry_delay)
+
+            # Serve from MongoDB until the stream is back
+            self._stop()
+            time.sleep(self._retry_delay)
+            self._retry_delay = min(self._retry_delay * 2, RETRY_MAX_SECONDS)
+
+    def _stop(self):
+        with self._lock:
+            self.ready = False
+
+    def _follow(self):
+        """Apply changes from the change stream until it ends or fails"""
+        collection = Listing._get_collection()
+        with collection.watch(
+            [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}],
+            full_document='updateLookup',
+            resume_after=self._resume_token
+        ) as stream:
+            self._retry_delay = RETRY_MIN_SECONDS
+
+            # Without a resume point, load the listings after opening the
+            # stream so no change made while loading is missed; those
+            # changes are replayed from the stream
+            if self._resume_token is None:
+                self._load(collection)
+            with self._lock:
+                self.ready = True
+            self._resume_token = stream.resume_token
+
+            for change in stream:
+                with self._lock:
+                    doc = change.get('fullDocument')
+                    if doc is None:
+                        self._remove(change['documentKey']['_id'])
+                    else:
+                        self._add(doc)
+                self._resume_token = stream.resume_token
+
+    def _load(self, collection):
+        with self._lock:
+            self.ready = False
+            self._docs.clear()
+            self._index.clear()
+        for doc in collection.find({'status': 'Published'}):
+            with self._lock:
+                self._add(doc)
+
+    def _add(self, doc):
+        self._remove(doc['_id'])
+        if doc.get('status') != 'Published':
+            return
+
+        doc = {field: doc.get(field) for field in ('_id',) + Listing.api_fields}
+        if not self._indexable(doc):
+            # Left out rather than indexed halfway; the keys of such a
+            # document could not be compared with the others
+            logger.warning('Listing feed skipped listing %s with missing or mistyped fields', doc['_id'])
+            return
+        self._docs[doc['_id']] = doc
+        for index_key, sort_key in self._keys(doc):
+            bisect.insort(self._index.setdefault(index_key, []), sort_key)
+
+    def _remove(self, listing_id):
+        doc = self._docs.pop(listing_id, None)
+        if doc is None:
+            return
+
+        for index_key, sort_key in self._keys(doc):
+            keys = self._index[index_key]
+            del keys[bisect.bisect_left(keys, sort_key)]
+
+    @staticmethod
+    def _indexable(doc):
+        return (
+            isinstance(doc['category'], str)
+            and isinstance(doc['created_at'], datetime)
+            and isinstance(doc['price'], (int, float))
+        )
+
+    @staticmethod
+    def _keys(doc):
+        for category in (None, doc['category']):
+            for field in SORT_FIELDS:
+                yield (category, field), (doc[field], doc['_id'])
+
+
+listing_feed = ListingFeed()
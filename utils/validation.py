@@ -0,0 +1,35 @@
+from bson import ObjectId
+from flask import request
+from flask_restful import abort
+
+
+def parse_oid(value):
+    """Convert a client-supplied id to an ObjectId, rejecting malformed ids with a 400"""
+    if not ObjectId.is_valid(value):
+        abort(400, error=f'Invalid id: {value}')
+    return ObjectId(value)
+
+
+def parse_pagination():
+    """Read ?page= and ?per_page=, rejecting values below 1 with a 400"""
+    page = int(request.args.get('page', 1))
+    per_page = int(request.args.get('per_page', 10))
+    if page < 1 or per_page < 1:
+        abort(400, error='page and per_page must be at least 1')
+    return page, per_page
+
+
+def get_json_body():
+    """Return the request's JSON body, rejecting anything but an object with a 400"""
+    data = request.get_json()
+    if not isinstance(data, dict):
+        abort(400, error='Request body must be a JSON object')
+    return data
+
+
+def parse_number(data, field, convert=int):
+    """Convert a client-supplied number with convert, rejecting values of the wrong type with a 400"""
+    try:
+        return convert(data[field])
+    except (TypeError, ValueError):
+        abort(400, error=f'{field} must be a number')